@@ -6,10 +6,36 @@ __author__ = "Thorsten Schnebeck"
 __date__ = "2023-05-29"
 
 
+from collections import namedtuple
 from smbus2 import SMBus, i2c_msg
 import time
 
 
+def _crc8_table(polynomial):
+    table = []
+    for index in range(256):
+        crc = index
+        for _ in range(8):
+            if crc & 0x80:
+                crc = (crc << 1) ^ polynomial
+            else:
+                crc <<= 1
+        table.append(crc & 0xFF)
+    return bytes(table)
+
+
+_CRC8_TABLE = _crc8_table(0x31)
+
+
+def _crc_of_pair(high, low):
+    return _CRC8_TABLE[_CRC8_TABLE[0xFF ^ high] ^ low]
+
+
+# cmd: measurement command, delay: maximum measurement time, wait: time before the first read attempt,
+# poll: time between further read attempts (all times in seconds)
+ModeSpec = namedtuple("ModeSpec", ["cmd", "delay", "wait", "poll"])
+
+
 class SHT4x:
     """
     Class to interface with the Sensirion SHT4x temperature and humidity sensor family.
@@ -20,35 +46,38 @@ class SHT4x:
     
     ADDRESS = 0x44         # I2C addresses (by order) of the SHT40 sensor: 0x44 or 0x45
     VALID_MODES = {
-        "high":            [0xFD, 0.01],
-        "medium":          [0xF6, 0.01],
-        "low":             [0xE0, 0.01],
-        "heat 1s 200mW":   [0x39, 1.01],
-        "heat 0.1s 200mW": [0x32, 0.11],
-        "heat 1s 110mW":   [0x2F, 1.01],
-        "heat 0.1s 110mW": [0x24, 0.11],
-        "heat 1s 20mW":    [0x1E, 1.01],
-        "heat 0.1s 20mW":  [0x15, 0.11],
+        "high":            ModeSpec(0xFD, 0.01, 0.006, 0.001),
+        "medium":          ModeSpec(0xF6, 0.01, 0.003, 0.001),
+        "low":             ModeSpec(0xE0, 0.01, 0.001, 0.001),
+        "heat 1s 200mW":   ModeSpec(0x39, 1.01, 0.9, 0.01),
+        "heat 0.1s 200mW": ModeSpec(0x32, 0.11, 0.09, 0.005),
+        "heat 1s 110mW":   ModeSpec(0x2F, 1.01, 0.9, 0.01),
+        "heat 0.1s 110mW": ModeSpec(0x24, 0.11, 0.09, 0.005),
+        "heat 1s 20mW":    ModeSpec(0x1E, 1.01, 0.9, 0.01),
+        "heat 0.1s 20mW":  ModeSpec(0x15, 0.11, 0.09, 0.005),
     }
+    _MODE_BY_CODE = {spec.cmd: name for name, spec in VALID_MODES.items()}
     CMD_SOFT_RESET = 0x94
     CMD_READ_SERIAL_NUMBER = 0x89
+    _T_SCALE = 175.0 / 65535.0
+    _H_SCALE = 125.0 / 65535.0
+    _H_RAW_LO = 3146       # raw humidity codes below this convert to < 0 %RH
+    _H_RAW_HI = 55573      # raw humidity codes above this convert to > 100 %RH
 
-    def __init__(self, bus=1, address=ADDRESS, mode="high"):
+    def __init__(self, bus=1, address=ADDRESS, mode="high", bus_factory=SMBus):
         self._i2c_bus = bus
         self._i2c_address = address
-        self._bus = SMBus(self._i2c_bus)
         self._valid = False
         self._serial_number = "None"
-        self._mode = 0
-        self._delay = 0.0
-        self._temperature = None
-        self._humidity = None
+        self._temperature_c = None
+        self._humidity_pct = None
+        self.mode = mode
+        self._bus = bus_factory(self._i2c_bus)
 
         self.reset()
         data = self._get_serial_number()
         if len(data) != 0:
-            self._serial_number = f"{hex(data[0])[2:].zfill(4) + hex(data[1])[2:].zfill(4)}"
-        self.mode = mode
+            self._serial_number = "%04x%04x" % (data[0], data[1])
 
     def __repr__(self) -> str:
         if self._serial_number == "":
@@ -64,20 +93,31 @@ class SHT4x:
     def _read_data_with_crc(self):
         read = i2c_msg.read(self._i2c_address, 6)
         self._bus.i2c_rdwr(read)
-        data = list(read)
-        crc1 = SHT4x._calculate_crc8(data[0:2])
-        crc2 = SHT4x._calculate_crc8(data[3:5])
-        if crc1 == data[2] and crc2 == data[5]:
-            return [data[0] << 8 | data[1], data[3] << 8 | data[4]]
+        msb1, lsb1, crc1, msb2, lsb2, crc2 = bytes(read)
+        if _crc_of_pair(msb1, lsb1) == crc1 and _crc_of_pair(msb2, lsb2) == crc2:
+            return [msb1 << 8 | lsb1, msb2 << 8 | lsb2]
         else:
             raise ValueError("CRC8 check failed")
 
+    def _poll_data_with_crc(self):
+        # the sensor NACKs reads until the measurement is done, so sleep through the typical measurement time
+        # and then retry until it answers or the maximum measurement time is over
+        deadline = time.monotonic() + self._delay
+        time.sleep(self._wait)
+        while True:
+            try:
+                return self._read_data_with_crc()
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(self._poll)
+
     def _get_serial_number(self) -> list:
         try:
             self._write_command(self.CMD_READ_SERIAL_NUMBER)
             time.sleep(0.01)
             return self._read_data_with_crc()
-        except:
+        except (OSError, ValueError):
             return []
 
     def reset(self) -> bool:
@@ -91,7 +131,7 @@ class SHT4x:
             self._write_command(SHT4x.CMD_SOFT_RESET)
             time.sleep(0.01)
             return True
-        except:
+        except OSError:
             return False
 
     def update(self) -> bool:
@@ -104,20 +144,36 @@ class SHT4x:
 
         try:
             self._write_command(self._mode)
-            time.sleep(self._delay)
-            self._temperature, self._humidity = self._read_data_with_crc()
+            raw_temperature, raw_humidity = self._poll_data_with_crc()
+            self._temperature_c = round(-45.0 + SHT4x._T_SCALE * raw_temperature, 1)
+            if raw_humidity < SHT4x._H_RAW_LO:
+                self._humidity_pct = 0.0
+            elif raw_humidity > SHT4x._H_RAW_HI:
+                self._humidity_pct = 100.0
+            else:
+                self._humidity_pct = round(-6.0 + SHT4x._H_SCALE * raw_humidity, 1)
             self._valid = True
             return True
-        except:
+        except (OSError, ValueError):
+            self._temperature_c = None
+            self._humidity_pct = None
             self._valid = False
             return False
 
+    def read(self) -> tuple:
+        """
+        Updates and returns the temperature and humidity readings from the sensor in one call.
+
+        :return: A tuple (temperature in degrees Celsius, relative humidity in %) or (None, None) when updating failed
+        """
+
+        if self.update():
+            return self._temperature_c, self._humidity_pct
+        return None, None
+
     @property
     def mode(self):
-        for this_mode in SHT4x.VALID_MODES:
-            if SHT4x.VALID_MODES[this_mode][0] == self._mode:
-                return f"{this_mode}"
-        return ""
+        return SHT4x._MODE_BY_CODE.get(self._mode, "")
 
     @mode.setter
     def mode(self, mode):
@@ -130,14 +186,14 @@ class SHT4x:
         :raises ValueError: If an invalid mode is provided.
         """
 
-        self._mode = None
-        for this_mode in SHT4x.VALID_MODES:
-            if this_mode == mode:
-                self._mode = SHT4x.VALID_MODES[mode][0]
-                self._delay = SHT4x.VALID_MODES[mode][1]
-                break
-        if self._mode == None:
-            raise ValueError("Invalid mode setting")
+        try:
+            spec = SHT4x.VALID_MODES[mode]
+        except KeyError:
+            raise ValueError("Invalid mode setting") from None
+        self._mode = spec.cmd
+        self._delay = spec.delay
+        self._wait = spec.wait
+        self._poll = spec.poll
 
     @property
     def serial_number(self):
@@ -149,13 +205,10 @@ class SHT4x:
         Get the temperature reading from the SHT4x sensor.
         This method returns the temperature in degrees Celsius of the last measurement update.
 
-        :return: The temperature in degrees Celsius or None if there was no update.
+        :return: The temperature in degrees Celsius or None if the last update failed or there was no update.
         """
 
-        temperature = None
-        if self._temperature != None:
-            temperature = round(-45.0 + 175.0 * self._temperature / 65535.0, 1)
-        return temperature
+        return self._temperature_c
 
     @property
     def humidity(self):
@@ -163,25 +216,7 @@ class SHT4x:
         Get the humidity reading from the SHT4x sensor.
         This method returns the relative humidity as a percentage of the last measurement update.
 
-        :return: The relative humidity as a percentage or None if there was no upate
+        :return: The relative humidity as a percentage or None if the last update failed or there was no update
         """
 
-        humidity = None
-        if self._humidity != None:
-            humidity = -6.0 + 125.0 * self._humidity / 65535.0
-            humidity = round(humidity, 1)
-            humidity = max(min(humidity, 100.0), 0.0)
-        return humidity
-
-    @staticmethod
-    def _calculate_crc8(data):
-        CRC8_POLYNOMIAL = 0x31
-        crc = 0xFF
-        for byte in data:
-            crc ^= byte
-            for _ in range(8):
-                if crc & 0x80:
-                    crc = (crc << 1) ^ CRC8_POLYNOMIAL
-                else:
-                    crc <<= 1
-        return crc & 0xFF
+        return self._humidity_pct
@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 
+import ctypes
+import math
 import unittest
 from unittest.mock import MagicMock, patch
 from SHT4x import SHT4x
@@ -7,62 +9,145 @@ from SHT4x import SHT4x
 
 class SHT4xTestCase(unittest.TestCase):
 
-    @patch('smbus2.SMBus')
-    def setUp(self, mock_smbus):
-        self.sensor = SHT4x()
+    def setUp(self):
+        self.bus_factory = MagicMock()
+        self.sensor = SHT4x(bus_factory=self.bus_factory)
 
     def tearDown(self):
         self.sensor = None
 
+    def _fill_read_buffer(self, payload):
+        def i2c_rdwr(*msgs):
+            ctypes.memmove(msgs[0].buf, payload, len(payload))
+        self.bus_factory.return_value.i2c_rdwr = MagicMock(side_effect=i2c_rdwr)
+
+    def _mock_reading(self, raw_temperature=None, raw_humidity=None, side_effect=None):
+        self.sensor._write_command = MagicMock()
+        if side_effect is None:
+            self.sensor._read_data_with_crc = MagicMock(return_value=[raw_temperature, raw_humidity])
+        else:
+            self.sensor._read_data_with_crc = MagicMock(side_effect=side_effect)
+
+    def _update_with(self, raw_temperature, raw_humidity):
+        self._mock_reading(raw_temperature, raw_humidity)
+        return self.sensor.update()
+
+    def test_bus_factory(self):
+        self.bus_factory.assert_called_once_with(1)
+        self.bus_factory.return_value.write_byte.assert_any_call(SHT4x.ADDRESS, SHT4x.CMD_SOFT_RESET)
+
+    def test_bus_open_failure(self):
+        with self.assertRaises(FileNotFoundError):
+            SHT4x(bus=7, bus_factory=MagicMock(side_effect=FileNotFoundError()))
+
+    def test_read_data_with_crc(self):
+        # 0xBEEF -> 0x92 is the CRC example from the Sensirion datasheet
+        self._fill_read_buffer(bytes([0xBE, 0xEF, 0x92, 0x00, 0x00, 0x81]))
+        self.assertEqual(self.sensor._read_data_with_crc(), [0xBEEF, 0x0000])
+
+    def test_read_data_with_crc_failure(self):
+        self._fill_read_buffer(bytes([0xBE, 0xEF, 0x92, 0x00, 0x00, 0x80]))
+        with self.assertRaises(ValueError):
+            self.sensor._read_data_with_crc()
+
     def test_reset_success(self):
         self.sensor._write_command = MagicMock()
         self.assertTrue(self.sensor.reset())
         self.sensor._write_command.assert_called_once_with(SHT4x.CMD_SOFT_RESET)
 
     def test_reset_failure(self):
-        self.sensor._write_command = MagicMock(side_effect=Exception())
+        self.sensor._write_command = MagicMock(side_effect=OSError())
         self.assertFalse(self.sensor.reset())
         self.sensor._write_command.assert_called_once_with(SHT4x.CMD_SOFT_RESET)
 
     def test_update_success(self):
-        self.sensor._write_command = MagicMock()
-        self.sensor._read_data_with_crc = MagicMock(return_value=[0x1234, 0x5678])
-        self.assertTrue(self.sensor.update())
+        self.assertTrue(self._update_with(0x1234, 0x5678))
         self.sensor._write_command.assert_called_once_with(self.sensor._mode)
         self.sensor._read_data_with_crc.assert_called_once()
+        self.assertAlmostEqual(self.sensor.temperature, -32.6, places=1)
+        self.assertAlmostEqual(self.sensor.humidity, 36.2, places=1)
 
     def test_update_failure(self):
-        self.sensor._write_command = MagicMock()
-        self.sensor._read_data_with_crc = MagicMock(side_effect=Exception())
+        self._mock_reading(side_effect=ValueError("CRC8 check failed"))
         self.assertFalse(self.sensor.update())
         self.sensor._write_command.assert_called_once_with(self.sensor._mode)
         self.sensor._read_data_with_crc.assert_called_once()
+        self.assertIsNone(self.sensor.temperature)
+        self.assertIsNone(self.sensor.humidity)
+
+    def test_update_polls_until_ready(self):
+        self._mock_reading(side_effect=[OSError(), OSError(), [0x1234, 0x5678]])
+        self.assertTrue(self.sensor.update())
+        self.assertEqual(self.sensor._read_data_with_crc.call_count, 3)
+
+    def test_update_poll_timeout(self):
+        self._mock_reading(side_effect=OSError())
+        self.assertFalse(self.sensor.update())
+        self.assertGreater(self.sensor._read_data_with_crc.call_count, 1)
+
+    def test_update_poll_attempts_bounded(self):
+        self.sensor.mode = 'heat 1s 200mW'
+        self._mock_reading(side_effect=OSError())
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        with patch('SHT4x.time.monotonic', side_effect=lambda: clock[0]), patch('SHT4x.time.sleep', side_effect=sleep):
+            self.assertFalse(self.sensor.update())
+        # first attempt after 0.9 s, then every 10 ms until the 1.01 s maximum is over
+        self.assertLessEqual(self.sensor._read_data_with_crc.call_count, 15)
+
+    def test_read_success(self):
+        self._mock_reading(0x1234, 0x5678)
+        temperature, humidity = self.sensor.read()
+        self.assertAlmostEqual(temperature, -32.6, places=1)
+        self.assertAlmostEqual(humidity, 36.2, places=1)
+
+    def test_read_failure(self):
+        self._mock_reading(side_effect=ValueError())
+        self.assertEqual(self.sensor.read(), (None, None))
 
     def test_mode_setter_valid_mode(self):
         mode = 'high'
         self.sensor.mode = mode
-        self.assertEqual(self.sensor._mode, SHT4x.VALID_MODES[mode][0])
-        self.assertEqual(self.sensor._delay, SHT4x.VALID_MODES[mode][1])
+        self.assertEqual(self.sensor._mode, SHT4x.VALID_MODES[mode].cmd)
+        self.assertEqual(self.sensor._delay, SHT4x.VALID_MODES[mode].delay)
 
     def test_mode_setter_invalid_mode(self):
         with self.assertRaises(ValueError):
             self.sensor.mode = 'invalid_mode'
 
+    def test_mode_setter_invalid_mode_keeps_mode(self):
+        self.sensor.mode = 'low'
+        with self.assertRaises(ValueError):
+            self.sensor.mode = 'invalid_mode'
+        self.assertEqual(self.sensor.mode, 'low')
+
+    def test_init_invalid_mode(self):
+        bus_factory = MagicMock()
+        with self.assertRaises(ValueError):
+            SHT4x(mode='invalid_mode', bus_factory=bus_factory)
+        bus_factory.assert_not_called()
+
     def test_mode_getter(self):
-        self.sensor._mode = SHT4x.VALID_MODES['high'][0]
+        self.sensor._mode = SHT4x.VALID_MODES['high'].cmd
         self.assertEqual(self.sensor.mode, 'high')
 
     def test_serial_number(self):
         self.sensor._serial_number = '0x12345678'
         self.assertEqual(self.sensor.serial_number, '0x12345678')
 
-    def test_temperature(self):
-        self.sensor._temperature = 0x1234
-        self.assertAlmostEqual(self.sensor.temperature, -32.6, places=1)
-
-    def test_humidity(self):
-        self.sensor._humidity = 0x5678
-        self.assertAlmostEqual(self.sensor.humidity, 36.2, places=1)
+    def test_humidity_clamped(self):
+        self._update_with(0x1234, 0x0000)
+        self.assertEqual(self.sensor.humidity, 0.0)
+        self._update_with(0x1234, 0xFFFF)
+        self.assertEqual(self.sensor.humidity, 100.0)
+        self._update_with(0x1234, SHT4x._H_RAW_LO - 1)
+        self.assertEqual(self.sensor.humidity, 0.0)
+        self.assertEqual(math.copysign(1.0, self.sensor.humidity), 1.0)  # 0.0, not -0.0
+        self._update_with(0x1234, SHT4x._H_RAW_HI)
+        self.assertEqual(self.sensor.humidity, 100.0)
 
 
 if __name__ == '__main__':